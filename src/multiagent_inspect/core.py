@@ -7,6 +7,7 @@ from inspect_ai.model._chat_message import (
     ChatMessageTool,
 )
 from inspect_ai.util import store
+from inspect_ai.model import CachePolicy
 from inspect_ai.model._model import get_model
 from inspect_ai.model._call_tools import call_tools
 from inspect_ai.solver import (
@@ -16,12 +17,19 @@ from inspect_ai.solver import (
 )
 from inspect_ai.solver._basic_agent import DEFAULT_SYSTEM_MESSAGE 
 from dataclasses import dataclass
-from typing import Optional, List
+from functools import lru_cache
+import itertools
+from typing import Optional, List, Union
 import tiktoken
 TOKEN_ENCODING = tiktoken.get_encoding("o200k_base")
 
 from inspect_ai.log import transcript
 
+_STATIC_SYS_MSG = ChatMessageSystem(
+    content=DEFAULT_SYSTEM_MESSAGE.format(submit='_end_run')
+    + "\n\nOnly attempt tasks which you think you can do with your limited set of tools. After running a task, you might be asked questions about it. Only answer things that you know that you have done."
+)
+
 @dataclass
 class SubAgentConfig:
     agent_id: Optional[str] = None
@@ -32,17 +40,36 @@ class SubAgentConfig:
     tools: Optional[list[Tool]] = None
     metadata: Optional[dict] = None
     max_token: int = 70000
+    cache: Union[bool, CachePolicy] = False
+    # When set, tool results older than the last max_retained_messages messages are truncated (never ones the
+    # model has not seen yet). Truncating rewrites an earlier message, which invalidates the provider prompt
+    # cache from that point on, so this trades prompt caching for a smaller transcript.
+    max_retained_messages: Optional[int] = None
 
 class SubAgent():
-    _id_counter = 1
+    __slots__ = (
+        "agent_id",
+        "max_steps",
+        "public_description",
+        "model",
+        "tools",
+        "metadata",
+        "max_token",
+        "cache",
+        "max_retained_messages",
+        "messages",
+        "_tools_with_end",
+        "_tool_names",
+        "_str_cache",
+    )
+    _id_counter = itertools.count(1)
 
     def __init__(self, config: SubAgentConfig):
+        if config.max_retained_messages is not None and config.max_retained_messages < 1:
+            raise ValueError("max_retained_messages must be at least 1")
         if config.agent_id is None:
-            config.agent_id = f"{SubAgent._id_counter:03d}"
-            SubAgent._id_counter += 1
+            config.agent_id = f"{next(SubAgent._id_counter):03d}"
             
-        sys_msg = DEFAULT_SYSTEM_MESSAGE.format(submit='_end_run')
-        sys_msg += f"\n\nOnly attempt tasks which you think you can do with your limited set of tools. After running a task, you might be asked questions about it. Only answer things that you know that you have done.\n\n{config.internal_description}"
         self.agent_id = config.agent_id
         self.max_steps = config.max_steps
         self.public_description = config.public_description
@@ -50,44 +77,85 @@ class SubAgent():
         self.tools = config.tools
         self.metadata = config.metadata
         self.max_token = config.max_token
-        self.messages: List[ChatMessage] = [ChatMessageSystem(content=sys_msg)]
+        self.cache = config.cache
+        self.max_retained_messages = config.max_retained_messages
+        self._tools_with_end: List[Tool] = (self.tools or []) + [_END_RUN_TOOL]
+        self._tool_names = tuple(_tool_name(t) for t in (self.tools or ()))
+        self._str_cache: Optional[str] = None
+        # The static system message is shared by all sub agents so the prompt prefix is identical across calls (prompt caching).
+        self.messages: List[ChatMessage] = [_STATIC_SYS_MSG]
+        if config.internal_description:
+            self.messages.append(ChatMessageSystem(content=config.internal_description))
 
     def __str__(self):
-        msg = (
-            f"ID: {self.agent_id}\n"
-            f"Model: {self.model}\n"
-            f"Description: {self.public_description}\n"
-            f"Max Steps: {self.max_steps}\n"
-        )
-        if self.tools:
-            tool_names = [ToolDef(t).name for t in self.tools]
-            msg += f"Tools: {tool_names}\n"
+        if self._str_cache is None:
+            msg = (
+                f"ID: {self.agent_id}\n"
+                f"Model: {self.model}\n"
+                f"Description: {self.public_description}\n"
+                f"Max Steps: {self.max_steps}\n"
+            )
+            if self._tool_names:
+                msg += f"Tools: {list(self._tool_names)}\n"
+            self._str_cache = msg
+
+        return self._str_cache
 
-        return msg
+@lru_cache(maxsize=1024)
+def _tool_name(tool: Tool) -> str:
+    """Return the registered name of a tool, resolving it only once per tool object."""
+    return ToolDef(tool).name
 
 def _trim_messages(messages: List[ChatMessage], max_tokens: int) -> List[ChatMessage]:
     """
     If the total tokens in messages exceed max_tokens, remove the earliest (non-system) messages until within limit.
-    Additionally, ensures that the first entry after the system message is not a tool call.
-    Always keep the first message (assumed to be the system message).
+    Additionally, ensures that the first entry after the system messages is not a tool call.
+    Always keep the leading system messages (at least the first message).
     Also limits total messages to 2000 by removing oldest non-system messages if exceeded.
     """
     def total_tokens(msgs: List[ChatMessage]) -> int:
         return sum(len(TOKEN_ENCODING.encode(msg.text)) for msg in msgs)
+
+    first = 1
+    while first < len(messages) and isinstance(messages[first], ChatMessageSystem):
+        first += 1
     
-    # First, remove messages (starting at index 1) until the token count is within limit.
-    while total_tokens(messages) > max_tokens and len(messages) > 1:
-        messages.pop(1)
+    # First, remove messages (starting after the system messages) until the token count is within limit.
+    while total_tokens(messages) > max_tokens and len(messages) > first:
+        messages.pop(first)
 
     # Then, ensure we don't exceed 2000 messages total
-    while len(messages) > 2000:
-        messages.pop(1)
+    while len(messages) > max(2000, first):
+        messages.pop(first)
 
     # Then, ensure that the first message after system is not a tool call.
-    while len(messages) > 1 and isinstance(messages[1], ChatMessageTool):
-        messages.pop(1)
+    while len(messages) > first and isinstance(messages[first], ChatMessageTool):
+        messages.pop(first)
     return messages
 
+TRUNCATED_TOOL_RESULT_CHARS = 200
+TRUNCATED_SUFFIX = "...[truncated]"
+
+def _truncate_tool_results(messages: List[ChatMessage], max_retained_messages: int) -> List[ChatMessage]:
+    """
+    Shorten the content of tool results that are older than the last max_retained_messages messages.
+    Tool results after the latest assistant message have not been seen by the model yet and are never truncated.
+    Truncated messages are replaced by copies, and messages that are already short enough are left untouched.
+    """
+    last_assistant = max(
+        (i for i, msg in enumerate(messages) if isinstance(msg, ChatMessageAssistant)), default=0
+    )
+    for i in range(min(len(messages) - max_retained_messages, last_assistant)):
+        msg = messages[i]
+        if (
+            isinstance(msg, ChatMessageTool)
+            and isinstance(msg.content, str)
+            and len(msg.content) > TRUNCATED_TOOL_RESULT_CHARS + len(TRUNCATED_SUFFIX)
+        ):
+            messages[i] = msg.model_copy(
+                update={"content": msg.content[:TRUNCATED_TOOL_RESULT_CHARS] + TRUNCATED_SUFFIX}
+            )
+    return messages
 
 @tool
 def _end_run() -> Tool:
@@ -99,46 +167,67 @@ def _end_run() -> Tool:
         return f"Run ended with reason: {stop_reason}"
     return execute
 
+_END_RUN_TOOL = _end_run()
+
+# Tool calls that end a sub agent run.
+_TERMINAL_TOOLS: frozenset[str] = frozenset({"_end_run"})
+
+def _sub_agents() -> dict[str, SubAgent]:
+    """
+    Return the sub agents of the current sample. The store is already a per-sample dict held in a
+    context variable, so this is a plain lookup that always sees the dict set by init_sub_agents.
+    """
+    return store().get("sub_agents", {})
+
 async def _get_agent(sub_agent_id: Optional[str] = None) -> Optional[SubAgent]:
-    sub_agents = store().get("sub_agents", {})
+    sub_agents = _sub_agents()
 
     if sub_agent_id is None:
-        sub_agent_id = list(sub_agents.keys())[0]
+        sub_agent_id = next(iter(sub_agents), None)
+        if sub_agent_id is None:
+            return None
 
-    if sub_agent_id not in sub_agents:
-        return None
-    return sub_agents[sub_agent_id]
+    return sub_agents.get(sub_agent_id)
 
 async def _update_store(sub_agent: SubAgent):
-    sub_agents = store().get("sub_agents", {})
+    sub_agents = _sub_agents()
+    # Sub agents are mutated in place, so the stored dict usually already holds this exact object.
+    if sub_agents.get(sub_agent.agent_id) is sub_agent:
+        return
     sub_agents[sub_agent.agent_id] = sub_agent
     store().set("sub_agents", sub_agents)
 
 async def _run_logic(sub_agent: SubAgent, instructions: str):
     sub_agent.messages.append(ChatMessageUser(content=instructions))
 
-    tools = (sub_agent.tools or []).copy()
-    tools.append(_end_run())
-    for steps in range(sub_agent.max_steps):
+    tools = sub_agent._tools_with_end
+    steps = 0
+    for step in range(sub_agent.max_steps):
+        steps = step + 1
         sub_agent.messages = _trim_messages(sub_agent.messages, sub_agent.max_token)
         
         output = await get_model(sub_agent.model).generate(
-            input=sub_agent.messages, tools=tools
+            input=sub_agent.messages, tools=tools, cache=sub_agent.cache
         )
         sub_agent.messages.append(output.message)
 
-        with transcript().step(f"sub-agent-{sub_agent.agent_id}-step-{steps}"):
+        with transcript().step(f"sub-agent-{sub_agent.agent_id}-step-{step}"):
             transcript().info(output.message.text)
 
         if output.message.tool_calls:
+            end_requested = not _TERMINAL_TOOLS.isdisjoint(tool_call.function for tool_call in output.message.tool_calls)
+            # Other tools requested alongside a terminal tool still run: every tool call needs a result
+            # message, since the transcript is sent back to the model when chatting afterwards.
             tool_results = await call_tools(
                 output.message, tools
             )
             sub_agent.messages.extend(tool_results)
+            if sub_agent.max_retained_messages is not None:
+                sub_agent.messages = _truncate_tool_results(sub_agent.messages, sub_agent.max_retained_messages)
 
-            if any(tool_result.function == "_end_run" for tool_result in tool_results):
+            if end_requested:
                 break
-    if steps == sub_agent.max_steps - 1:
+    else:
         sub_agent.messages.append(ChatMessageAssistant(content="I have reached the maximum number of steps. I will stop here."))
 
     await _update_store(sub_agent)
@@ -149,13 +238,25 @@ async def _chat_logic(sub_agent: SubAgent, question: str):
     sub_agent.messages = _trim_messages(sub_agent.messages, sub_agent.max_token)
     
     output = await get_model(sub_agent.model).generate(
-        input=sub_agent.messages
+        input=sub_agent.messages, cache=sub_agent.cache
     )
     sub_agent.messages.append(output.message)
 
     await _update_store(sub_agent)
     return output.message.text
 
+@lru_cache(maxsize=None)
+def _sub_agent_tools(single_sub_agent: bool) -> tuple[Tool, ...]:
+    """
+    Build the sub agent management tools once per mode. The tools hold no state of their own
+    (they read the sub agents from the store), so the same instances can be shared by every sample.
+    """
+    return (
+        sub_agent_specs(single_sub_agent=single_sub_agent),
+        run_sub_agent(single_sub_agent=single_sub_agent),
+        chat_with_sub_agent(single_sub_agent=single_sub_agent),
+    )
+
 @solver
 def init_sub_agents(sub_agent_configs: list[SubAgentConfig]):
     async def solve(state: TaskState, generate: Generate) -> TaskState:
@@ -165,10 +266,7 @@ def init_sub_agents(sub_agent_configs: list[SubAgentConfig]):
         sub_agents = [SubAgent(config) for config in sub_agent_configs]
         store().set("sub_agents", {agent.agent_id: agent for agent in sub_agents})
 
-        if len(sub_agents) > 1:
-            state.tools.extend([sub_agent_specs(), run_sub_agent(), chat_with_sub_agent()])
-        elif len(sub_agents) == 1:
-            state.tools.extend([sub_agent_specs(single_sub_agent=True), run_sub_agent(single_sub_agent=True), chat_with_sub_agent(single_sub_agent=True)])
+        state.tools.extend(_sub_agent_tools(single_sub_agent=len(sub_agents) == 1))
         
         
         return state
@@ -197,7 +295,7 @@ def sub_agent_specs(single_sub_agent: bool = False) -> Tool:
             Returns:
                 str: Specifications of the sub agents.
             """
-            sub_agents = store().get("sub_agents", {})
+            sub_agents = _sub_agents()
             return "\n".join([str(sub_agent) for sub_agent in sub_agents.values()])
         return execute_multi
 
@@ -10,11 +10,12 @@ from inspect_ai import Task, eval
 from inspect_ai.dataset import Sample
 from inspect_ai.solver import solver
 from inspect_ai.solver._chain import chain
+from inspect_ai.model import ModelOutput, get_model
 
-from multiagent_inspect.core import _trim_messages, TOKEN_ENCODING
+from multiagent_inspect.core import _run_logic, _trim_messages, _truncate_tool_results, TOKEN_ENCODING, TRUNCATED_TOOL_RESULT_CHARS, TRUNCATED_SUFFIX
 
 sys.path.append(str(Path(__file__).parent.parent))
-from multiagent_inspect import SubAgentConfig, init_sub_agents
+from multiagent_inspect import SubAgent, SubAgentConfig, init_sub_agents
 
 @tool
 def dummy_tool():
@@ -127,6 +128,62 @@ async def test_multiple_tool_calls_removed(state: TaskState):
     assert trimmed[0].text == sys_msg.text, "System message must be preserved"
     assert trimmed[1].text == user_msg.text, "User message should follow system message after removing tool messages"
 
+async def test_system_messages_preserved(state: TaskState):
+    static_msg = ChatMessageSystem(content="Static system")
+    agent_msg = ChatMessageSystem(content="Agent system")
+    tool_msg = ChatMessageTool(content="Tool", function="dummy_tool")
+    user_msg = ChatMessageUser(content="U" * 100)
+    asst_msg = ChatMessageAssistant(content="A" * 10)
+    messages = [static_msg, agent_msg, tool_msg, user_msg, asst_msg]
+    max_tokens = sum(len(TOKEN_ENCODING.encode(m.text)) for m in [static_msg, agent_msg, asst_msg])
+    trimmed = _trim_messages(messages.copy(), max_tokens)
+    assert trimmed[0] is static_msg and trimmed[1] is agent_msg, "All leading system messages must be preserved"
+    assert len(trimmed) == 3, "Expected the tool and user messages to be trimmed"
+    assert trimmed[2].text == asst_msg.text, "Most recent message should be kept"
+
+async def test_old_tool_results_truncated(state: TaskState):
+    sys_msg = ChatMessageSystem(content="System")
+    user_msg = ChatMessageUser(content="User")
+    old_tool_msg = ChatMessageTool(content="T" * 1000, function="dummy_tool")
+    short_tool_msg = ChatMessageTool(content="short", function="dummy_tool")
+    fresh_tool_msgs = [ChatMessageTool(content="F" * 1000, function="dummy_tool") for _ in range(3)]
+    messages = [
+        sys_msg, user_msg,
+        ChatMessageAssistant(content="A"), old_tool_msg,
+        ChatMessageAssistant(content="A"), short_tool_msg,
+        ChatMessageAssistant(content="A"), *fresh_tool_msgs,
+    ]
+    truncated = _truncate_tool_results(messages.copy(), max_retained_messages=1)
+    assert truncated[3].text == "T" * TRUNCATED_TOOL_RESULT_CHARS + TRUNCATED_SUFFIX, "Old tool result should be truncated"
+    assert old_tool_msg.text == "T" * 1000, "Original message object should not be mutated"
+    assert truncated[5] is short_tool_msg, "Short tool results should be left untouched"
+    assert truncated[7:] == fresh_tool_msgs, "Tool results the model has not seen yet should be left untouched"
+    assert _truncate_tool_results(truncated.copy(), max_retained_messages=1) == truncated, "Truncation should be idempotent"
+
+    try:
+        SubAgent(SubAgentConfig(agent_id="truncate", max_retained_messages=0))
+        assert False, "max_retained_messages < 1 should be rejected"
+    except ValueError:
+        pass
+
+async def test_run_zero_steps(state: TaskState):
+    agent = SubAgent(SubAgentConfig(agent_id="zero", max_steps=0))
+    result = await _run_logic(agent, "Do nothing")
+    assert "ran for 0 steps" in result, f"Expected 0 steps to be reported, got: {result}"
+
+async def test_end_run_on_last_step(state: TaskState):
+    model = get_model(
+        "mockllm/model",
+        custom_outputs=[
+            ModelOutput.for_tool_call(model="mockllm/model", tool_name="_end_run", tool_arguments={"stop_reason": "done"})
+        ],
+    )
+    agent = SubAgent(SubAgentConfig(agent_id="last_step", max_steps=1, model=model))
+    result = await _run_logic(agent, "End the run")
+    assert "ran for 1 steps" in result, f"Expected 1 step to be reported, got: {result}"
+    assert type(agent.messages[-1]) == ChatMessageTool and agent.messages[-1].function == "_end_run", "Run should end with the _end_run result"
+    assert not any("maximum number of steps" in msg.text for msg in agent.messages), "Run ended via _end_run should not get the max steps message"
+
 @solver
 def test_solver():
     async def solve(state: TaskState, generate: Generate) -> TaskState:
@@ -145,7 +202,11 @@ if __name__ == "__main__":
         test_trim_messages_removes,
         test_trim_messages_no_removal,
         test_tool_first_message_removed,
-        test_multiple_tool_calls_removed
+        test_multiple_tool_calls_removed,
+        test_system_messages_preserved,
+        test_old_tool_results_truncated,
+        test_run_zero_steps,
+        test_end_run_on_last_step
     ]
 
     dataset = []